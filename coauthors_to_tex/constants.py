@@ -9,6 +9,8 @@ Created on 2024-08-30 at 12:16
 
 @author: cook
 """
+import os
+
 # =============================================================================
 # Define variables
 # =============================================================================
@@ -32,6 +34,17 @@ GID3 = '223170284'
 GID4 = '671986807'
 # allowed paper styles
 ALLOWED_PAPER_STYLES = ['AJ', 'AANDA']
+# directory where the google sheets are cached between runs
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'coauthors_to_tex')
+# time in seconds for which a cached google sheet is used without
+#    downloading it again
+CACHE_TTL = 300
+# setting this environment variable (to anything but 0) switches the cache
+#    off, the google sheets are then always downloaded and nothing is
+#    written to CACHE_DIR
+NO_CACHE_ENV = 'COAUTHORS_NO_CACHE'
+# time in seconds to wait for google before giving up on a download
+DOWNLOAD_TIMEOUT = 30
 
 # -----------------------------------------------------------------------------
 # Define a translation between accented letters to the latex equivalent
@@ -83,6 +96,15 @@ LETTER_2_LATEX['ã'] = '\\~a'
 LETTER_2_LATEX['õ'] = '\\~o'
 LETTER_2_LATEX['Ã'] = '\\~A'
 LETTER_2_LATEX['Õ'] = '\\~O'
+# translation table to replace all the single letters above in a single pass
+LATEX_TRANSLATE = str.maketrans({letter: latex for letter, latex
+                                 in LETTER_2_LATEX.items() if len(letter) == 1})
+# any multi-character sequences above (e.g. letters with combining accents)
+#    cannot go in the translation table and are replaced with a regex
+LATEX_MULTI = {letter: latex for letter, latex in LETTER_2_LATEX.items()
+               if len(letter) > 1}
+# the ascii characters above (pure ascii text without these needs no change)
+LATEX_ASCII_LETTERS = [letter for letter in LETTER_2_LATEX if letter.isascii()]
 
 
 # =============================================================================
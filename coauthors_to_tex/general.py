@@ -8,28 +8,56 @@ Created on 2024-08-13 at 12:50
 @author: cook
 """
 
+import argparse
+import functools
+import io
+import json
 import os
+import re
 import shutil
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
 
 import numpy as np
-import wget
-from astropy.table import Table, vstack
 from coauthors_to_tex import constants
 
+# astropy and requests are slow to import, so they are only imported when
+#    they are needed (this keeps e.g. "coauthors2tex --help" fast)
+if TYPE_CHECKING:
+    import requests
+    from astropy.table import Table
+
 # =============================================================================
 # Define variables
 # =============================================================================
 __version__ = constants.__version__
 __date__ = constants.__date__
+# runs of two or more spaces
+MULTI_SPACE = re.compile(' {2,}')
+# any of the multi-character sequences to latexify (longest first, so that
+#    a longer sequence wins over one it contains), None if there are none
+if len(constants.LATEX_MULTI) > 0:
+    LATEX_MULTI_RE = re.compile('|'.join(
+        re.escape(letter) for letter in
+        sorted(constants.LATEX_MULTI, key=len, reverse=True)))
+else:
+    LATEX_MULTI_RE = None
+# the requests sessions, one per thread (see get_session)
+SESSIONS = threading.local()
 
 
 # =============================================================================
 # Define functions
 # =============================================================================
+@functools.lru_cache(maxsize=1)
 def get_terminal_width() -> int:
     """
     This function returns the width of the terminal, there is a default value
-    of 80 if the width cannot be determined
+    of 80 if the width cannot be determined (the width is only looked up once)
 
     :return: int, the width of the terminal
     """
@@ -37,6 +65,53 @@ def get_terminal_width() -> int:
     return terminal_size.columns
 
 
+def print_lines(*lines: str):
+    """
+    This function prints several lines with a single write to stdout
+    (rather than one print per line)
+
+    :param lines: the lines to print
+    """
+    sys.stdout.write('\n'.join(lines) + '\n')
+
+
+def print_error(*lines: str, char: str = '~'):
+    """
+    This function prints an error message between two lines of characters
+    as wide as the terminal (the message is written in one go)
+
+    :param lines: the lines of the error message
+    :param char: the character used for the lines around the message
+    """
+    hline = char * get_terminal_width()
+    print_lines(hline, *lines, hline)
+
+
+def exit_error(*lines: str, char: str = '~', sheet_error: bool = True):
+    """
+    This function prints an error message (see print_error) and exits
+
+    :param lines: the lines of the error message
+    :param char: the character used for the lines around the message
+    :param sheet_error: if True the error is in the google sheets (see
+                        exit_sheet_error)
+    """
+    print_error(*lines, char=char)
+    if sheet_error:
+        exit_sheet_error()
+    sys.exit(1)
+
+
+def exit_sheet_error():
+    """
+    This function exits after an error in the google sheets, the cached
+    copies of the sheets are expired first so that the corrected sheets
+    are downloaded on the next run (--no-refresh still uses them)
+    """
+    expire_cache()
+    sys.exit(1)
+
+
 def safe_latex(txt: str) -> str:
     """
     This function replaces the special characters by the latex equivalent
@@ -57,54 +132,194 @@ def latexify_accents(txt: str) -> str:
     :param txt:
     :return: txt with latex accents
     """
-    for letter in constants.LETTER_2_LATEX.keys():
-        txt = txt.replace(letter, constants.LETTER_2_LATEX[letter])
-    return txt
+    # most of the text is pure ascii, which only needs translating if it
+    #    contains one of the ascii characters we replace (e.g. '_')
+    if txt.isascii():
+        if not any(letter in txt for letter in constants.LATEX_ASCII_LETTERS):
+            return txt
+    # multi-character sequences first (in a single pass), they may contain
+    #    single letters
+    if LATEX_MULTI_RE is not None:
+        txt = LATEX_MULTI_RE.sub(
+            lambda match: constants.LATEX_MULTI[match.group(0)], txt)
+    return txt.translate(constants.LATEX_TRANSLATE)
+
+
+def get_session() -> 'requests.Session':
+    """
+    This function returns the requests session of the current thread, so
+    that the connection to google is kept alive between the sheets a thread
+    downloads (requests sessions are not guaranteed to be thread safe, so
+    threads never share one). It is created on first use, so requests is
+    only imported when needed
+
+    :return: the requests session
+    """
+    session = getattr(SESSIONS, 'session', None)
+    if session is None:
+        import requests
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = 'gzip'
+        SESSIONS.session = session
+    return session
 
 
-def read_google_sheet_csv(sheet_id: str, gid: str) -> Table:
+def cache_disabled() -> bool:
     """
-    This function reads a Google sheet and returns the content as an
-    astropy table
+    This function checks whether the cache was switched off with the
+    constants.NO_CACHE_ENV environment variable
+
+    :return: bool, True if the google sheets must always be downloaded
+    """
+    return os.environ.get(constants.NO_CACHE_ENV, '') not in ['', '0']
+
+
+def expire_cache(sheet_id: str = constants.SHEET_ID):
+    """
+    This function marks all the cached copies of the google sheets as out
+    of date, they are then checked with google on the next run
+
+    :param sheet_id: the google sheet to expire the cached copies of
+    """
+    if cache_disabled() or not os.path.isdir(constants.CACHE_DIR):
+        return
+    for filename in os.listdir(constants.CACHE_DIR):
+        if filename.startswith(f'{sheet_id}_') and filename.endswith('.csv'):
+            os.utime(os.path.join(constants.CACHE_DIR, filename), (0, 0))
+
+
+def fetch_google_sheet_csv(sheet_id: str, gid: str,
+                           session: Optional['requests.Session'] = None,
+                           no_refresh: bool = False,
+                           force_refresh: bool = False) -> bytes:
+    """
+    This function returns the csv content of a Google sheet
+
+    The sheet is cached in constants.CACHE_DIR and only downloaded again
+    once the cached copy is older than constants.CACHE_TTL seconds. An
+    older copy is revalidated with google (with the ETag and Last-Modified
+    google sent with it) and only downloaded again if the sheet has changed
 
     :param sheet_id:
     :param gid:
-    :return: the astropy table
+    :param session: the requests session to download with (defaults to
+                    the session of the current thread from get_session)
+    :param no_refresh: if True, use the cached copy whatever its age
+    :param force_refresh: if True, always download the sheet (the cache
+                          is still updated)
+    :return: the csv content
     """
-    if os.path.exists('.tmp.csv'):
-        os.remove('.tmp.csv')
+    # with the cache switched off we neither read nor write the cache
+    use_cache = not cache_disabled()
+    cache_path = os.path.join(constants.CACHE_DIR, f'{sheet_id}_{gid}.csv')
+    # the ETag and Last-Modified google sent with the cached copy are kept
+    #    next to it
+    meta_path = cache_path + '.meta.json'
+
+    have_cache = (use_cache and os.path.exists(cache_path)
+                  and not force_refresh)
+    if have_cache:
+        cache_age = time.time() - os.path.getmtime(cache_path)
+        if no_refresh or cache_age < constants.CACHE_TTL:
+            # we say so, as edits made to the sheet since then are not seen
+            print_lines(f'Using cached sheet {gid} from {cache_age:.0f}s '
+                        f'ago (run with --no-cache after editing)')
+            with open(cache_path, 'rb') as cache_file:
+                return cache_file.read()
+
+    # we ask google to only send the sheet if it changed since it was cached
+    #    (with google's own ETag and date, not the time of the cached file,
+    #    which is reset when the cache is expired)
+    headers = dict()
+    if have_cache and os.path.exists(meta_path):
+        with open(meta_path, 'r') as meta_file:
+            meta = json.load(meta_file)
+        if meta.get('etag') is not None:
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified') is not None:
+            headers['If-Modified-Since'] = meta['last_modified']
 
     csv_url = constants.GOOGLE_URL.format(sheet_id=sheet_id, gid=gid)
+    if session is None:
+        session = get_session()
+    response = session.get(csv_url, headers=headers,
+                           timeout=constants.DOWNLOAD_TIMEOUT)
+    # the cached copy is still valid, we restart its time to live
+    if have_cache and response.status_code == 304:
+        os.utime(cache_path)
+        with open(cache_path, 'rb') as cache_file:
+            return cache_file.read()
+    response.raise_for_status()
+    content = response.content
+    if not use_cache:
+        return content
+    os.makedirs(constants.CACHE_DIR, exist_ok=True)
+    # we write to a temporary file and then move it into place, so an
+    #    interrupted write never leaves a partial file in the cache
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as tmp_file:
+        tmp_file.write(content)
+    os.replace(tmp_path, cache_path)
+    # we keep the ETag and Last-Modified (if any) to revalidate the cached
+    #    copy next time
+    meta = dict(etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'))
+    with open(meta_path, 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+    return content
+
+
+def read_google_sheet_csv(sheet_id: str, gid: str,
+                          session: Optional['requests.Session'] = None,
+                          no_refresh: bool = False,
+                          force_refresh: bool = False) -> 'Table':
+    """
+    This function reads a Google sheet and returns the content as an
+    astropy table
 
-    _ = wget.download(csv_url, out='.tmp.csv', bar=None)
-    tbl = Table.read('.tmp.csv', format='ascii.csv')
-
-    key = tbl.keys()[0]
-    tbl = tbl[np.array(tbl[key]) != '']
-    tbl = tbl[np.array(tbl[key]) != '0']
-
-    # this is to remove the empty lines in the ORCID column
-    if 'ORCID' in tbl.keys():
-        orcid = np.array(tbl['ORCID'])
-        for i in range(len(orcid)):
-            if len(orcid[i]) < 16:
-                orcid[i] = ''
-        tbl['ORCID'] = orcid
-
-    for key in tbl.keys():
-        v = np.char.array(tbl[key])
-        # strip the strings for leading and trailing spaces
-        v = v.strip(',')
-        v = v.strip()
-        tbl[key] = v
-
-    # just for sanity, we remove the empty temporary file
-    os.remove('.tmp.csv')
-
-    # we remove all columns that have 'COMMENT' in the name
-    for key in tbl.keys():
+    :param sheet_id:
+    :param gid:
+    :param session: the requests session to download with (defaults to
+                    the session of the current thread from get_session)
+    :param no_refresh: if True, use the cached copy whatever its age
+    :param force_refresh: if True, always download the sheet
+    :return: the astropy table
+    """
+    from astropy.table import Table
+
+    content = fetch_google_sheet_csv(sheet_id, gid, session, no_refresh,
+                                     force_refresh)
+
+    # we parse the csv straight from memory rather than from a file on disk
+    #    (the format is known so there is no guessing, and the fast C reader
+    #    only handles ascii, so for sheets with accents we go straight to the
+    #    python reader rather than trying the fast reader first)
+    raw_tbl = Table.read(io.BytesIO(content), format='ascii.csv', guess=False,
+                         fast_reader=content.isascii())
+
+    # we clean the columns as plain numpy arrays and only build the final
+    #    table once, at the end
+    # we remove the rows with an empty (or '0') first column
+    first_column = np.asarray(raw_tbl[raw_tbl.keys()[0]])
+    keep = (first_column != '') & (first_column != '0')
+
+    columns = dict()
+    for key in raw_tbl.keys():
+        # we remove all columns that have 'COMMENT' in the name
         if 'COMMENT' in key.upper():
-            del tbl[key]
+            continue
+        values = np.asarray(raw_tbl[key], dtype=str)[keep]
+        # this is to remove the empty lines in the ORCID column
+        if key == 'ORCID':
+            values[np.char.str_len(values) < 16] = ''
+        # strip the strings for leading and trailing commas (only needed if
+        #    the column has any commas) and then spaces
+        if np.char.count(values, ',').any():
+            values = np.char.strip(values, ',')
+        columns[key] = np.char.strip(values)
+
+    tbl = Table(list(columns.values()), names=list(columns.keys()), copy=False)
 
     return tbl
 
@@ -120,25 +335,71 @@ def clear():
 
 
 def check_columns(tbl, colnames):
-    # We check that the table has a set of column names and no other columns
-    for col_name in colnames:
-        if col_name not in tbl.keys():
-            print('~' * get_terminal_width())
-            print(f'Error: the table should have a column named *{col_name}*')
-            print('Please check the table')
-            print('~' * get_terminal_width())
-            exit()
-    for col_name in tbl.keys():
-        if col_name not in colnames:
-            print('~' * get_terminal_width())
-            print(f'Error: the table should not have a column named *{col_name}*')
-            print('Please check the table')
-            print('~' * get_terminal_width())
-            exit()
+    """
+    This function checks that the table has a set of column names and no
+    other columns
+
+    :param tbl: the table to check
+    :param colnames: the column names the table should have
+    :raises ValueError: if the columns are not correct (the message lists
+                        all the problems)
+    :return: True if the columns are correct
+    """
+    have, want = set(tbl.keys()), set(colnames)
+    # the lists keep the order of the columns for the messages
+    missing = [col_name for col_name in colnames if col_name not in have]
+    extra = [col_name for col_name in tbl.keys() if col_name not in want]
+    if len(missing) > 0 or len(extra) > 0:
+        lines = []
+        for col_name in missing:
+            lines.append(f'Error: the table should have a column named *{col_name}*')
+        for col_name in extra:
+            lines.append(f'Error: the table should not have a column named *{col_name}*')
+        lines.append('Please check the table')
+        raise ValueError('\n'.join(lines))
 
     return True
 
 
+def abbreviate_names(names: np.ndarray, nchars: np.ndarray) -> np.ndarray:
+    """
+    This function keeps the first nchars letters of each name, for names
+    with a space (or else a hyphen) this is done for the first two parts
+    of the name (keeping the hyphen)
+
+    :param names: numpy array of names
+    :param nchars: numpy array, the number of letters to keep for each name
+    :return: the abbreviated names
+    """
+    # the first part of the name, the separator and the second part
+    #    (the second part stops at the next separator, as for str.split)
+    space_parts = np.char.partition(names, ' ')
+    space_second = np.char.partition(space_parts[:, 2], ' ')[:, 0]
+    hyphen_parts = np.char.partition(names, '-')
+    hyphen_second = np.char.partition(hyphen_parts[:, 2], '-')[:, 0]
+    # a space takes precedence over a hyphen
+    has_space = space_parts[:, 1] != ''
+    has_hyphen = ~has_space & (hyphen_parts[:, 1] != '')
+
+    abbreviations = np.zeros(len(names), dtype='U100')
+    # casting to a shorter string type truncates the strings, so we do all
+    #    names that keep the same number of letters at once
+    for nchar in np.unique(nchars):
+        dtype = f'U{nchar}'
+        rows = nchars == nchar
+        with_space = np.char.add(space_parts[:, 0].astype(dtype),
+                                 space_second.astype(dtype))
+        with_hyphen = np.char.add(np.char.add(hyphen_parts[:, 0].astype(dtype),
+                                              '-'),
+                                  hyphen_second.astype(dtype))
+        abbreviation = np.where(has_space, with_space,
+                                np.where(has_hyphen, with_hyphen,
+                                         names.astype(dtype)))
+        abbreviations[rows] = abbreviation[rows]
+
+    return abbreviations
+
+
 def mk_initials(first_names, last_names):
     """
     This function creates the initials of the authors
@@ -146,97 +407,114 @@ def mk_initials(first_names, last_names):
     :param last_names:
     :return: the initials
     """
+    first_names = np.asarray(first_names, dtype=str)
+    last_names = np.asarray(last_names, dtype=str)
+
     initials = np.zeros(len(first_names), dtype='U100')
+    if len(first_names) == 0:
+        return initials
 
     # We get started with the number of letters in the last name
     Nlast = np.ones(len(last_names), dtype=int)
 
 
+    # Remove 'de' or 'da' from the last names if they are there
+    for prefix in ['de ', 'da ']:
+        has_prefix = np.char.startswith(np.char.lower(last_names), prefix)
+        without_prefix = np.char.partition(last_names, ' ')[:, 2]
+        last_names = np.where(has_prefix, without_prefix, last_names)
+
+    # one letter for each part of the first name, this does not change
+    #    between iterations
+    first_initials = abbreviate_names(first_names, np.ones_like(Nlast))
+
     duplicate = np.ones(len(last_names), dtype=bool)
 
     Nite = 0
     while True in duplicate:
-        # Remove 'de' or 'da' from the last names if they are there
-        for i in range(len(last_names)):
-            if last_names[i].lower().startswith('de '):
-                last_names[i] = last_names[i][3:]
-            if last_names[i].lower().startswith('da '):
-                last_names[i] = last_names[i][3:]
-
-        for i in range(len(first_names)):
-
-            # if first name contains a space, then we have to split it
-            if ' ' in first_names[i]:
-                first_name = first_names[i].split(' ')
-                initials[i] = first_name[0][0] + first_name[1][0]
-            elif '-' in first_names[i]:
-                first_name = first_names[i].split('-')
-                initials[i] = first_name[0][0] +'-'+ first_name[1][0]
-            else:
-                initials[i] = first_names[i][0]
-
-            # if last name contains a space, then we have to split it
-            if ' ' in last_names[i]:
-                last_name = last_names[i].split(' ')
-                initials[i] += last_name[0][0:Nlast[i]] + last_name[1][0:Nlast[i]]
-            elif '-' in last_names[i]:
-                last_name = last_names[i].split('-')
-                initials[i] += last_name[0][0:Nlast[i]] +'-'+ last_name[1][0:Nlast[i]]
-            else:
-                initials[i] += last_names[i][0:Nlast[i]]
+        # Nlast letters for each part of the last name, only the duplicates
+        #    (all authors the first time) have a new Nlast and need redoing
+        rows = np.where(duplicate)[0]
+        initials[rows] = np.char.add(first_initials[rows],
+                                     abbreviate_names(last_names[rows],
+                                                      Nlast[rows]))
 
-        duplicate = np.zeros(len(initials), dtype=bool)
-        for i in range(len(initials)):
-            for j in range(i+1, len(initials)):
-                if initials[i] == initials[j]:
-                    duplicate[i] = True
-                    duplicate[j] = True
+        # an author is a duplicate if their initials appear more than once
+        unique_initials, counts = np.unique(initials, return_counts=True)
+        duplicate = np.isin(initials, unique_initials[counts > 1])
 
         Nlast[duplicate] += 1
         Nite += 1
         if Nite > 10:
-            print('~' * get_terminal_width())
-            print('Error: too many iterations to find unique initials')
-            print('Please check the list of authors')
-            print('We keep having problems finding unique initials')
-            print('of coauthors {}'.format('+'.join(initials[duplicate])))
-            print('~' * get_terminal_width())
-            exit()
+            exit_error('Error: too many iterations to find unique initials',
+                       'Please check the list of authors',
+                       'We keep having problems finding unique initials',
+                       'of coauthors {}'.format('+'.join(initials[duplicate])))
 
 
     return initials
 
 
 
+def get_args() -> argparse.Namespace:
+    """
+    This function reads the command line arguments
+
+    :return: the parsed arguments
+    """
+    parser = argparse.ArgumentParser(description='Generate a latex author '
+                                                 'list from the google sheets')
+    # the two options contradict each other
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--no-refresh', action='store_true',
+                       help='Use the cached google sheets whatever their '
+                            'age (e.g. when working offline)')
+    group.add_argument('--no-cache', action='store_true',
+                       help='Always download the google sheets, even if the '
+                            'cached copies are recent')
+    return parser.parse_args()
+
+
 def main():
+    args = get_args()
+    no_refresh = args.no_refresh
+    force_refresh = args.no_cache
+
+    from astropy.table import Table, vstack
+
     sheet_id = constants.SHEET_ID
     gid0, gid1 = constants.GID0, constants.GID1
     gid2, gid3 = constants.GID2, constants.GID3
     gid4 = constants.GID4
     allowed_paper_styles = constants.ALLOWED_PAPER_STYLES
-
-    # We fetch the data from the google sheet
-    print('\nWe fetch the data from the google sheet -- list of papers')
-    tbl_papers = read_google_sheet_csv(sheet_id, gid0)
-    print('\nWe fetch the data from the google sheet -- list of '
-          'affiliations')
-
-    if check_columns(tbl_papers, ['paper key', 'STYLE','ACKNOWLEDGEMENTS', 'author list']):
-        print('Columns are correct')
-    else:
-        exit()
-
-    tbl_affiliations = read_google_sheet_csv(sheet_id, gid1)
-    print('\nWe fetch the data from the google sheet -- list of authors '
-          '[NIRPS]')
-
-    if check_columns(tbl_affiliations,  ['SHORTNAME', 'AFFILIATION']):
-        print('Columns are correct')
+    # the line used to frame the messages
+    hline = '~' * get_terminal_width()
+
+    # We fetch the data from the google sheet, the sheets are independent
+    #    so we download them all at the same time (each download thread
+    #    uses its own session, see get_session)
+    print('\nWe fetch the data from the google sheet')
+    gids = [gid0, gid1, gid2, gid4]
+    if gid3 is not None:
+        gids.append(gid3)
+    with ThreadPoolExecutor(max_workers=len(gids)) as executor:
+        futures = dict()
+        for gid in gids:
+            futures[gid] = executor.submit(read_google_sheet_csv, sheet_id,
+                                           gid, None, no_refresh,
+                                           force_refresh)
+        tables = dict()
+        for gid in gids:
+            tables[gid] = futures[gid].result()
+
+    tbl_papers = tables[gid0]
+    tbl_affiliations = tables[gid1]
+    tbl_nirps_authors = tables[gid2]
+    if gid3 is not None:
+        tbl_nonnirps_authors = tables[gid3]
     else:
-        exit()
-
-    print('\nWe fetch the data from the google sheet -- list of authors ')
-    tbl_nirps_authors = read_google_sheet_csv(sheet_id, gid2)
+        tbl_nonnirps_authors = Table()
+    tbl_acknowledgements = tables[gid4]
 
     colnames = ['AUTHOR',
                 'Last Name',
@@ -246,66 +524,96 @@ def main():
                 'SHORTNAME',
                 'AFFILIATIONS',
                 'ACKNOWLEDGEMENTS']
-
-    if check_columns(tbl_nirps_authors, colnames):
-        print('Columns are correct')
-    else:
-        exit()
-
-    print('\nWe fetch the data from the google sheet -- list of authors '
-          '[non-NIRPS]')
+    column_checks = [('list of papers', tbl_papers,
+                      ['paper key', 'STYLE','ACKNOWLEDGEMENTS', 'author list']),
+                     ('list of affiliations', tbl_affiliations,
+                      ['SHORTNAME', 'AFFILIATION']),
+                     ('list of authors [NIRPS]', tbl_nirps_authors, colnames)]
     if gid3 is not None:
-        tbl_nonnirps_authors = read_google_sheet_csv(sheet_id, gid3)
-
-        if check_columns(tbl_nonnirps_authors, colnames):
+        column_checks.append(('list of authors [non-NIRPS]',
+                              tbl_nonnirps_authors, colnames))
+    column_checks.append(('list of acknowledgements', tbl_acknowledgements,
+                          ['ACKNOWLEDGEMENTS', 'ACKNOWLEDGEMENTS_TEXT']))
+
+    # We check the columns of all the tables before stopping, so that all
+    #    the problems are reported at once
+    bad_columns_flag = False
+    for description, tbl, tbl_colnames in column_checks:
+        print(f'\nWe check the columns -- {description}')
+        try:
+            check_columns(tbl, tbl_colnames)
             print('Columns are correct')
-        else:
-            exit()
-
-
-    else:
-        tbl_nonnirps_authors = Table()
-
-    print('\nWe fetch the data from the google sheet -- list of acknowledgements')
-    tbl_acknowledgements = read_google_sheet_csv(sheet_id, gid4)
-    if check_columns(tbl_acknowledgements, ['ACKNOWLEDGEMENTS', 'ACKNOWLEDGEMENTS_TEXT']):
-        print('Columns are correct')
-    else:
-        exit()
+        except ValueError as error:
+            print_error(str(error))
+            bad_columns_flag = True
+    if bad_columns_flag:
+        exit_sheet_error()
+
+    # We map each affiliation SHORTNAME and each acknowledgement to its text
+    #    (if one is defined more than once the first definition is used)
+    affil_text_map = dict()
+    ack_text_map = dict()
+    duplicate_keys = []
+    text_checks = [('affiliation', affil_text_map,
+                    tbl_affiliations['SHORTNAME'].tolist(),
+                    tbl_affiliations['AFFILIATION'].tolist()),
+                   ('acknowledgement', ack_text_map,
+                    tbl_acknowledgements['ACKNOWLEDGEMENTS'].tolist(),
+                    tbl_acknowledgements['ACKNOWLEDGEMENTS_TEXT'].tolist())]
+    for description, text_map, keys, texts in text_checks:
+        for key, text in zip(keys, texts):
+            if text_map.setdefault(key, text) != text:
+                duplicate_keys.append((description, key))
 
     clear()
 
+    # We warn about the keys defined more than once with different texts
+    for description, key in dict.fromkeys(duplicate_keys):
+        print_error(f'Warning: the {description} *{key}* is defined more than once with different texts',
+                    'The first one in the google sheet is used')
+
 
     duplicate_authors_flag = False
     # We check if authors are duplicated in the two tables
-    for i in range(len(tbl_nirps_authors)):
-        for j in range(len(tbl_nonnirps_authors)):
-            if tbl_nirps_authors['SHORTNAME'][i] == tbl_nonnirps_authors['SHORTNAME'][j]:
-                print('~' * get_terminal_width())
-                print(
-                    f'Error: the author *{tbl_nirps_authors["SHORTNAME"][i]}* is duplicated in the two author lists (NIRPS and non-NIRPS)')
-                print('~' * get_terminal_width())
-                duplicate_authors_flag = True
+    nonnirps_shortnames = set()
+    if len(tbl_nonnirps_authors) > 0:
+        nonnirps_shortnames = set(tbl_nonnirps_authors['SHORTNAME'].tolist())
+    for shortname in tbl_nirps_authors['SHORTNAME'].tolist():
+        if shortname in nonnirps_shortnames:
+            print_error(f'Error: the author *{shortname}* is duplicated in the two author lists (NIRPS and non-NIRPS)')
+            duplicate_authors_flag = True
     if duplicate_authors_flag:
-        exit()
+        exit_sheet_error()
 
     # We concatenate the two tables of authors, to have a single table
     # with all authors
     tbl_authors = vstack([tbl_nirps_authors, tbl_nonnirps_authors])
 
+    # We split the affiliations and acknowledgements of each author once
+    #    (without spaces), these lists are used for all the checks and
+    #    outputs below
+    author_affils = [affils.replace(' ', '').split(',')
+                     for affils in tbl_authors['AFFILIATIONS'].tolist()]
+    author_acks = [acks.replace(' ', '').split(',')
+                   for acks in tbl_authors['ACKNOWLEDGEMENTS'].tolist()]
+
     # We have a sanity check to see if the all styles are allowed
-    for i in range(len(tbl_papers)):
-        if tbl_papers['STYLE'][i].upper() not in allowed_paper_styles:
-            print('~' * get_terminal_width())
-            print(f'Error: the style *{tbl_papers["STYLE"][i]}* is not allowed')
-            print('Please select a style in the list :')
-            for style in allowed_paper_styles:
-                print(style)
-            print('~' * get_terminal_width())
-            exit()
+    #    (all the bad styles are reported at once)
+    allowed_styles = frozenset(style.upper() for style in allowed_paper_styles)
+    paper_styles = np.char.upper(np.asarray(tbl_papers['STYLE'], dtype=str))
+    bad_styles = [tbl_papers['STYLE'][i]
+                  for i, style in enumerate(paper_styles.tolist())
+                  if style not in allowed_styles]
+    if len(bad_styles) > 0:
+        lines = [f'Error: the style *{style}* is not allowed'
+                 for style in bad_styles]
+        exit_error(*lines, 'Please select a style in the list :',
+                   *allowed_paper_styles)
 
     # We check that all authors exist in the list of authors as defined on the google sheet
     bad_author_flag = False
+    # (a set of all the short names, so each author is a single lookup)
+    author_set = set(tbl_authors['SHORTNAME'].tolist())
     for i in range(len(tbl_papers)):
         authors = tbl_papers['author list'][i].split(',')
         for author in authors:
@@ -313,15 +621,13 @@ def main():
                 print('There is an empty author in the author list of paper : {}'.format(tbl_papers['paper key'][i]))
                 print('Please remove the empty author')
                 continue
-            if author not in tbl_authors['SHORTNAME']:
-                print('~' * get_terminal_width())
-                print('There is a problem in the co-author list of paper : {}'.format(tbl_papers['paper key'][i]))
-                print(f'Error: the author *{author}* is not in the list of authors')
-                print('Please add the author to the list of authors')
-                print('~' * get_terminal_width())
+            if author not in author_set:
+                print_error('There is a problem in the co-author list of paper : {}'.format(tbl_papers['paper key'][i]),
+                            f'Error: the author *{author}* is not in the list of authors',
+                            'Please add the author to the list of authors')
                 bad_author_flag = True
     if bad_author_flag:
-        exit()
+        exit_sheet_error()
 
     # We ask the user to select the paper for which he wants the
     #    latex author list
@@ -335,140 +641,134 @@ def main():
 
     # We check if the paper number is in the list
     if ipaper < 0 or ipaper >= len(tbl_papers):
-        print('~' * get_terminal_width())
-        print(f'Error: the paper number {ipaper + 1} is not in the list')
-        print('Please select a number between 1 and {}'.format(len(tbl_papers)))
-        print('~' * get_terminal_width())
-        exit()
+        exit_error(f'Error: the paper number {ipaper + 1} is not in the list',
+                   'Please select a number between 1 and {}'.format(len(tbl_papers)),
+                   sheet_error=False)
 
     bad_affil_flag = False
     # We check that all affiliations exist in the list of affiliations
-    for i in range(len(tbl_authors)):
-        affil_author = (tbl_authors['AFFILIATIONS'][i].replace(' ', '')).split(',')
-
+    for i, affil_author in enumerate(author_affils):
         for affil in affil_author:
-            if affil not in tbl_affiliations['SHORTNAME']:
-                print('~' * get_terminal_width())
-                print(f'Error: the affiliation *{affil}* is not in the list of affiliations')
-                print(f'This is a problem for author: {tbl_authors["AUTHOR"][i]}')
-                print('Please add the affiliation to the list of affiliations')
-                print('~' * get_terminal_width())
+            if affil not in affil_text_map:
+                print_error(f'Error: the affiliation *{affil}* is not in the list of affiliations',
+                            f'This is a problem for author: {tbl_authors["AUTHOR"][i]}',
+                            'Please add the affiliation to the list of affiliations')
                 bad_affil_flag = True
     if bad_affil_flag:
-        exit()
+        exit_sheet_error()
 
     bad_ack = False
     # We check that the acknowledgements are in the list of acknowledgements
-    for i in range(len(tbl_authors)):
-        ack_author = (tbl_authors['ACKNOWLEDGEMENTS'][i].replace(' ', '')).split(',')
+    for i, ack_author in enumerate(author_acks):
         if ack_author == ['0']:
             continue
 
         for ack in ack_author:
-            if ack not in tbl_acknowledgements['ACKNOWLEDGEMENTS']:
-                print('~' * get_terminal_width())
-                print(f'Error: the acknowledgement *{ack}* is not in the list of acknowledgements')
-                print(f'This is a problem for author: {tbl_authors["AUTHOR"][i]}')
-                print('Please add the acknowledgement to the list of acknowledgements')
-                print('~' * get_terminal_width())
+            if ack not in ack_text_map:
+                print_error(f'Error: the acknowledgement *{ack}* is not in the list of acknowledgements',
+                            f'This is a problem for author: {tbl_authors["AUTHOR"][i]}',
+                            'Please add the acknowledgement to the list of acknowledgements')
                 bad_ack = True
     if bad_ack:
-        exit()
+        exit_sheet_error()
 
     # We clear the terminal
     clear()
 
     # We create a table with the authors of the selected paper
-    # Initialize tbl_authors_paper with the same columns as tbl_authors
-    tbl_authors_paper = Table(names=tbl_authors.colnames,
-                              dtype=[tbl_authors[col].dtype for col in tbl_authors.colnames])
-
-    authors_paper = np.array(tbl_papers[ipaper]['author list'].split(','))
-
-
-    # We fill the table with the authors information
-    for j in range(len(authors_paper)):
-        for i in range(len(tbl_authors)):
-            if authors_paper[j] == tbl_authors['SHORTNAME'][i]:
-                tbl_authors_paper.add_row(tbl_authors[i])
+    authors_paper = tbl_papers[ipaper]['author list'].split(',')
+
+    # We index the authors by SHORTNAME once, so that each author of the
+    #    paper is a single dictionary lookup rather than a scan of all authors
+    author_rows = dict()
+    for i, shortname in enumerate(np.asarray(tbl_authors['SHORTNAME'])):
+        author_rows.setdefault(shortname, []).append(i)
+
+    # An author of the paper with more than one row in the author lists
+    #    cannot be indexed (it is not clear which row should be used)
+    duplicate_rows_flag = False
+    for shortname in dict.fromkeys(authors_paper):
+        if len(author_rows.get(shortname, [])) > 1:
+            print_error(f'Error: the author *{shortname}* has {len(author_rows[shortname])} rows in the author lists',
+                        f'Please keep a single row for *{shortname}* in the google sheet')
+            duplicate_rows_flag = True
+    if duplicate_rows_flag:
+        exit_sheet_error()
+    author_idx = {shortname: rows[0] for shortname, rows in author_rows.items()}
+
+    # We take all the rows of the paper authors at once (empty authors have
+    #    already been reported above and are skipped)
+    rows = [author_idx[shortname] for shortname in authors_paper
+            if shortname in author_idx]
+    tbl_authors_paper = tbl_authors[np.array(rows, dtype=int)]
 
     # We create the initials of the authors
     tbl_authors_paper['INITIALS'] = mk_initials(tbl_authors_paper['First Name'], tbl_authors_paper['Last Name'])
 
     # Sanity checks of the author list
     # First check: are there duplicates in the author list
-    for i in range(len(tbl_authors_paper)):
-        for j in range(i + 1, len(tbl_authors_paper)):
-            if tbl_authors_paper['SHORTNAME'][i] == tbl_authors_paper['SHORTNAME'][j]:
-                print('~' * get_terminal_width())
-                print(f'Error: the author *{tbl_authors_paper["SHORTNAME"][i]}* is duplicated in the author list')
-                print('~' * get_terminal_width())
-                exit()
+    counts = Counter(tbl_authors_paper['SHORTNAME'])
+    duplicates = [shortname for shortname in counts if counts[shortname] > 1]
+    if len(duplicates) > 0:
+        exit_error(f'Error: the author *{duplicates[0]}* is duplicated in the author list')
     # Second check: are all the authors in the author list
     for i in range(len(tbl_authors_paper)):
         if tbl_authors_paper['AUTHOR'][i] == '':
-            print('~' * get_terminal_width())
-            print(f'Error: the author *{tbl_authors_paper["SHORTNAME"][i]}* is not in the author list')
-            print('Add to either the NIRPS or non-NIRPS author list')
-            print('~' * get_terminal_width())
-            exit()
+            exit_error(f'Error: the author *{tbl_authors_paper["SHORTNAME"][i]}* is not in the author list',
+                       'Add to either the NIRPS or non-NIRPS author list')
 
     # We find the style of the paper references
     paper_style = tbl_papers[ipaper]['STYLE'].upper()
 
+    # We take the columns needed for the output as plain lists, indexing these
+    #    is much cheaper than indexing the astropy columns element by element
+    paper_authors = tbl_authors_paper['AUTHOR'].tolist()
+    paper_orcids = tbl_authors_paper['ORCID'].tolist()
+    # We take the affiliations already split for the authors of the paper
+    split_affils = [author_affils[row] for row in rows]
+
     # We create the latex output for the Astronomical Journal style
     if paper_style == 'AJ':
-        output = ''
-        for iauthor in range(len(tbl_authors_paper)):
-            author = tbl_authors_paper['AUTHOR'][iauthor]
-            orcid = tbl_authors_paper['ORCID'][iauthor]
+        parts = []
+        for iauthor in range(len(paper_authors)):
+            author = paper_authors[iauthor]
+            orcid = paper_orcids[iauthor]
             if len(orcid) > 4:
                 orcid = '[' + orcid + ']'
             else:
                 orcid = ''
 
-            output += '\\author' + orcid + '{' + author + '}\n'
+            parts.append('\\author' + orcid + '{' + author + '}\n')
 
-            author_affiliations = tbl_authors_paper['AFFILIATIONS'][iauthor].split(',')
+            for affil in split_affils[iauthor]:
+                affiliation = affil_text_map[affil]
+                parts.append('\\affiliation{' + affiliation + '}\n')
 
-            for affil in author_affiliations:
-                g = tbl_affiliations['SHORTNAME'] == affil
-                affiliation = tbl_affiliations[g]['AFFILIATION'][0]
-                output += '\\affiliation{' + affiliation + '}\n'
-
-            output += '\n'
+            parts.append('\n')
 
     # We create the latex output for the Astronomy and Astrophysics style
     elif paper_style == 'AANDA':
         # loop through authors to find affliations in order
-        ordered_affiliations = []
-        ordered_numerical_tags = []
-        for affil in tbl_authors_paper['AFFILIATIONS']:
-            for a in affil.split(','):
-                a_str = a.strip()
-                if a_str not in ordered_affiliations:
-                    ordered_affiliations.append(a_str)
-                    ordered_numerical_tags.append(str(len(ordered_affiliations)))
-
-        ordered_affiliations = np.array(ordered_affiliations)
-        ordered_numerical_tags = np.array(ordered_numerical_tags)
-
-        output = ''
+        #    (a dictionary keeps the insertion order and maps each affiliation
+        #    to its numerical tag)
+        tag_map = dict()
+        for author_affiliations in split_affils:
+            for a_str in author_affiliations:
+                if a_str not in tag_map:
+                    tag_map[a_str] = str(len(tag_map) + 1)
 
-        output += '\\author{\n'
-        for iauthor in range(len(tbl_authors_paper)):
-            author = tbl_authors_paper['AUTHOR'][iauthor]
+        parts = []
+        parts.append('\\author{\n')
+        for iauthor in range(len(paper_authors)):
+            author = paper_authors[iauthor]
 
-            author_affiliations = tbl_authors_paper['AFFILIATIONS'][iauthor].split(',')
+            author_affiliations = split_affils[iauthor]
 
             affil_txt = '\\inst{'
 
             for affil in author_affiliations:
                 affil_str = affil.strip()
-                # ordered_numerical_tags[affil == ordered_affiliations][0]
-                valid = np.where(affil == ordered_affiliations)[0]
-                print(affil_str,valid)
-                affil_txt += ordered_numerical_tags[affil_str == ordered_affiliations][0]
+                affil_txt += tag_map[affil_str]
                 if affil_str != author_affiliations[-1]:
                     affil_txt += ','
 
@@ -477,137 +777,117 @@ def main():
 
             affil_txt += '}'
 
-            output += author + affil_txt
-            if iauthor != len(tbl_authors_paper) - 1:
-                output += ',\n'
+            parts.append(author + affil_txt)
+            if iauthor != len(paper_authors) - 1:
+                parts.append(',\n')
             else:
-                output += '\n'
+                parts.append('\n')
 
-        output += '}\n'
-        output += '\n'
+        parts.append('}\n')
+        parts.append('\n')
 
-        output += '\\institute{\n'
-        for iaffil in range(len(ordered_affiliations)):
-            affiliation_text = tbl_affiliations['AFFILIATION'][tbl_affiliations['SHORTNAME'] == ordered_affiliations[
-                iaffil]][0]
-            output += '\\inst{' + ordered_numerical_tags[iaffil] + '}' + affiliation_text + '\\\\\n'
-        output += '\inst{*}\\email{' + tbl_authors_paper['EMAIL'][0] + '}\n'
-        output += '}\n'
+        parts.append('\\institute{\n')
+        for affil_str, tag in tag_map.items():
+            affiliation_text = affil_text_map[affil_str]
+            parts.append('\\inst{' + tag + '}' + affiliation_text + '\\\\\n')
+        parts.append('\\inst{*}\\email{' + tbl_authors_paper['EMAIL'][0] + '}\n')
+        parts.append('}\n')
 
     else:
         raise ValueError(f'The style {paper_style} is not implemented')
 
+    # we join all the parts of the output at once
+    output = ''.join(parts)
+
     output = latexify_accents(output)
     output = safe_latex(output)
 
     # We print the latex output
-    print('~' * get_terminal_width())
-    print(output)
-    print('~' * get_terminal_width())
-    print('\tCo-author list for arXiv submission')
-    print('~' * get_terminal_width())
-    print(latexify_accents(', '.join(tbl_authors_paper['AUTHOR'])))
+    print_lines(hline, output, hline,
+                '\tCo-author list for arXiv submission', hline,
+                latexify_accents(', '.join(tbl_authors_paper['AUTHOR'])))
 
 
-    ackoutput = ''
+    # we collect the parts of the acknowledgements and join them at the end
+    ack_parts = []
 
     ack_paper = tbl_papers[ipaper]['ACKNOWLEDGEMENTS']
     for ack in ack_paper.replace(' ','').split(','):
         if ack == '0':
             continue
-        g_ack = tbl_acknowledgements['ACKNOWLEDGEMENTS'] == ack
-
-        if np.sum(g_ack) == 0:
-            print('*'*get_terminal_width())
-            print('\n')
-            print('\tError with the acknowledgement {}'.format(ack))
-            print('\tThe acknowledgement is not in the google sheet')
-            print('\tPlease fix the acknowledgement in the google sheet')
-            print('\n')
-            print('*'*get_terminal_width())
+        if ack not in ack_text_map:
+            exit_error('\n',
+                       '\tError with the acknowledgement {}'.format(ack),
+                       '\tThe acknowledgement is not in the google sheet',
+                       '\tPlease fix the acknowledgement in the google sheet',
+                       '\n', char='*')
 
-            exit()
 
-
-        tmp = tbl_acknowledgements['ACKNOWLEDGEMENTS_TEXT'][g_ack].data[0]
+        tmp = ack_text_map[ack]
         if '{INITIALS}' in tmp:
-
-            print('*'*get_terminal_width())
-            print('\n')
-            print('\tError with the acknowledgement {}'.format(ack))
-            print('\tThe text of the acknowledgement contains {INITIALS}')
-            print('\t but it is used for the entire paper. This is not allowed')
-            print('\tYou should attribute the acknowledgement to authors')
-            print('\tPlease fix the acknowledgement in the google sheet')
-            print('\n')
-            print('*'*get_terminal_width())
-
-            exit()
-        ackoutput += tmp + '\\\\\n'
-
-    # we find all the unique acknowledgements
-    unique_acknowledgements = []
-    for ack in tbl_authors_paper['ACKNOWLEDGEMENTS']:
-        ack2 = ack.replace(' ','').split(',')
-        for aa in ack2:
-            if aa == '0':
+            exit_error('\n',
+                       '\tError with the acknowledgement {}'.format(ack),
+                       '\tThe text of the acknowledgement contains {INITIALS}',
+                       '\t but it is used for the entire paper. This is not allowed',
+                       '\tYou should attribute the acknowledgement to authors',
+                       '\tPlease fix the acknowledgement in the google sheet',
+                       '\n', char='*')
+        ack_parts.append(tmp + '\\\\\n')
+
+    # we find all the unique acknowledgements and the initials of the
+    #    authors they apply to, in a single pass over the authors
+    #    (the dictionary keeps the order in which they first appear)
+    ack_initials = dict()
+    for row, initials in zip(rows, tbl_authors_paper['INITIALS'].tolist()):
+        for aa in author_acks[row]:
+            if aa in ['', '0']:
                 continue
-            if aa not in unique_acknowledgements:
-                unique_acknowledgements.append(aa)
-
-
-
-
-    for iuack, uack in enumerate(unique_acknowledgements):
-        who = []
-        for in_ack in range(len(tbl_authors_paper)):
-            if uack in tbl_authors_paper['ACKNOWLEDGEMENTS'][in_ack]:
-                who.append(tbl_authors_paper['INITIALS'][in_ack])
+            who = ack_initials.setdefault(aa, [])
+            # an author listing an acknowledgement twice is only named once
+            if len(who) == 0 or who[-1] != initials:
+                who.append(initials)
 
+    for iuack, (uack, who) in enumerate(ack_initials.items()):
         # We join with a come except the last one that has an &
         if len(who) > 1:
-            who_txt = ', '.join(who[:-1]) + ' \\& ' + who[-1] + ' '
+            who_txt = f"{', '.join(who[:-1])} \\& {who[-1]} "
         else:
-            who_txt = who[0] + ' '
+            who_txt = f'{who[0]} '
 
-        g_ack = tbl_acknowledgements['ACKNOWLEDGEMENTS'] == uack
-        txt_ack =  tbl_acknowledgements['ACKNOWLEDGEMENTS_TEXT'][g_ack].data[0]
+        txt_ack = ack_text_map[uack]
         if '{INITIALS}' in txt_ack:
             txt_ack = txt_ack.replace('{INITIALS}', who_txt)
 
 
-        ackoutput += txt_ack
-        if iuack != len(unique_acknowledgements) - 1:
-            ackoutput += '\\\\\n'
-
-    ackoutput = latexify_accents(ackoutput)
+        ack_parts.append(txt_ack)
+        if iuack != len(ack_initials) - 1:
+            ack_parts.append('\\\\\n')
 
-    print('~' * get_terminal_width())
-    print('\tAcknowledgements ')
-    print('~' * get_terminal_width())
-    print(ackoutput)
-    print('~' * get_terminal_width())
+    ackoutput = latexify_accents(''.join(ack_parts))
 
-    output = output + '\n\n' + ackoutput
+    print_lines(hline, '\tAcknowledgements ', hline, ackoutput, hline)
 
-
-    while '  ' in output:
-        output = output.replace('  ', ' ')  # remove double spaces
+    # remove double spaces (the two blocks are separated by an empty line
+    #    so they can be cleaned separately rather than joined first)
+    output = MULTI_SPACE.sub(' ', output)
+    ackoutput = MULTI_SPACE.sub(' ', ackoutput)
 
     # output to a file called tbl_papers['paper key'][i]+'_coauthors.tex'
-    with open(tbl_papers[ipaper]['paper key'] + '_coauthors.tex', 'w') as f:
-        f.write(output)
-
-    print('~' * get_terminal_width())
-    print('\t co-author emails')
-
-    for i in range(len(tbl_authors_paper)):
-        email = str(tbl_authors_paper['EMAIL'][i]).strip(' ')
-        if email == '0':
-            tbl_authors_paper['EMAIL'][i] = '[' + tbl_authors_paper['AUTHOR'][i]+']'
-
-    print(', '.join(tbl_authors_paper['EMAIL']))
-    print('~' * get_terminal_width())
+    with open(tbl_papers[ipaper]['paper key'] + '_coauthors.tex', 'wb') as f:
+        f.writelines([output.encode('utf-8'), b'\n\n',
+                      ackoutput.encode('utf-8')])
+
+    # authors without an email ('0') are listed as [AUTHOR] instead (np.where
+    #    gives a string type long enough for either, so nothing is truncated)
+    emails = np.char.strip(np.asarray(tbl_authors_paper['EMAIL'], dtype=str), ' ')
+    authors = np.asarray(tbl_authors_paper['AUTHOR'], dtype=str)
+    missing = emails == '0'
+    emails = np.where(missing, np.char.add(np.char.add('[', authors), ']'),
+                      emails)
+    tbl_authors_paper['EMAIL'] = emails
+
+    print_lines(hline, '\t co-author emails',
+                ', '.join(tbl_authors_paper['EMAIL']), hline)
 
 # =============================================================================
 # Start of code